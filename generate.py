@@ -4,7 +4,9 @@ This script processes PDF files, extracts structured data from them, and saves t
 The PDF files should be downloaded in the 'pdf' folder from any of Turkish 'Probel' hospital system
 
 Requirements:
-- chardet: Character encoding detection library
+- charset-normalizer: Character encoding detection library
+- orjson: Fast JSON parsing/serialization library
+- google-re2 (optional): Linear-time regex engine used for row extraction when installed
 - pdf2htmlEX: PDF to HTML conversion tool in 'exe' folder
 
 Usage:
@@ -22,15 +24,28 @@ URL: github.com/diffstorm
 Date: 01/10/2023
 """
 
+import concurrent.futures
 import subprocess
-import chardet
+import charset_normalizer
 import re
 import os
 import html
-import json
+import orjson
 import sys
 import shutil
 from datetime import datetime
+from pathlib import Path
+
+# google-re2 (linear-time C++ engine) speeds up the hot row scan over
+# large HTML buffers considerably; fall back to the stdlib engine when
+# it is not installed
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+# Directory this script lives in; all relative folders are resolved against it
+_SCRIPT_DIR = Path(__file__).resolve().parent
 
 # Exe directory is the folder where pdf2htmlEX is
 exe_dir = "exe"
@@ -38,12 +53,59 @@ exe_dir = "exe"
 # pdf directory is where the pdf files are
 pdf_dir = "pdf"
 
+# Absolute paths built once, with os-native separators
+EXE_PATH = _SCRIPT_DIR / exe_dir
+PDF_PATH = _SCRIPT_DIR / pdf_dir
+
 # Out directory is the temporary folder that pdf2htmlEX generates its data
 out_dir = "out"
 
 # Database file that all the parsed data recorded
 data_file = "data.json"
 
+# Append-only journal holding rows extracted during a run; compacted
+# into the database file at the end of the run
+journal_file = "data.json.log"
+
+# Precompiled regex patterns, compiled once at import time since they are
+# applied repeatedly over large HTML buffers
+_FLOAT_RE = re.compile(r'\d+(?:,\d+)+|\d+,\d+')
+_ROW_RE = (re2 or re).compile(r'(\d{2}/\d{2}/\d{4} \d{2}:\d{2})\|(\d+(?:[.,]\d+)?)\|([^|\n]+)\|([^|\n]+)\|(\d+(?:[.,]\d+)?)\|([^|\n]*)\|')
+
+# Per-process caches deduplicating the heavily repeated unit/name
+# strings and memoizing the comma fixup per distinct range
+_STRING_CACHE = {}
+_RANGE_CACHE = {}
+
+# Removal patterns for the attributes stripped from every file, built
+# once at import; remove_attribute adds to the table on first use of
+# any other attribute
+_ATTR_PATTERNS = {
+    ("class", '"'): re.compile(r'class="[^"]*"'),
+    ("id", '"'): re.compile(r'id="[^"]*"'),
+    ("data-data", "'"): re.compile(r"data-data='[^']*'"),
+    ("data-page-no", '"'): re.compile(r'data-page-no="[^"]*"'),
+}
+
+# Fused HTML cleanup patterns: one sweep strips the div/span markup
+# (tolerating leftover spaces before '>'), a second sweep after entity
+# decoding and '*' marker removal collapses spaces around the '|'
+# separators
+_HTML_TAG_RE = re.compile(r'(</div *></div *><div *><div *>)|(</div *><div *>)|</?div *>|</?span *>|( +>)')
+_BAR_FIX_RE = re.compile(r' +\| *|\| +')
+
+def _html_tag_replacement(match):
+    """
+    Return the replacement for a single _HTML_TAG_RE match.
+    """
+    if match.group(1):
+        return '|'
+    if match.group(2):
+        return ' '
+    if match.group(3):
+        return '>'
+    return ''
+
 def check_directory(directory_name):
     """
     Check if the specified directory exists.
@@ -54,11 +116,7 @@ def check_directory(directory_name):
     Raises:
         SystemExit: Exits the script if the directory does not exist.
     """
-    current_directory = os.path.dirname(os.path.abspath(__file__))
-    target_directory = os.path.join(current_directory, directory_name)
-    if not os.path.exists(target_directory) or not os.path.isdir(target_directory):
-        return False
-    return True
+    return (_SCRIPT_DIR / directory_name).is_dir()
 
 def remove_directory(directory_name):
     """
@@ -67,56 +125,100 @@ def remove_directory(directory_name):
     Args:
         directory_name (str): The name of the directory to remove.
     """
-    current_directory = os.path.dirname(os.path.abspath(__file__))
-    target_directory = os.path.join(current_directory, directory_name)
-    if os.path.exists(target_directory) and os.path.isdir(target_directory):
+    target_directory = _SCRIPT_DIR / directory_name
+    if target_directory.is_dir():
         shutil.rmtree(target_directory)
         print(f"'{directory_name}' directory removed.")
 
-def run_process(command):
+def run_process(argv):
     """
-    Run a shell command and capture its output.
+    Run an external program and capture its output.
 
     Args:
-        command (str): The shell command to run.
+        argv (list): The program path followed by its arguments.
     """
-    print(command)
-    current_directory = os.path.dirname(os.path.abspath(__file__))
+    print(" ".join(argv))
+    # Skip console window allocation on Windows
+    creationflags = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
     try:
-        result = subprocess.run(os.path.join(current_directory, command), shell=True, capture_output=True, text=True, check=True)
+        result = subprocess.run(argv, capture_output=True, text=True, check=True, creationflags=creationflags)
         print("Output:", result.stdout)
         print("Errors:", result.stderr)
     except subprocess.CalledProcessError as e:
         print("Error occurred with return code:", e.returncode)
         print("Error message:", e.stderr)
 
-def save_as_json(data, file_path):
+def load_existing(file_path):
     """
-    Save a list of data entries as a JSON file.
+    Load previously saved data entries from a JSON file.
 
     Args:
-        data (list): List of data entries (dictionaries).
-        file_path (str): The path to the JSON file where data will be saved.
+        file_path (str): The path to the JSON file to load.
+
+    Returns:
+        dict: Data entries keyed by their unique (date, name) identifier.
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            existing_data = json.load(file)
-    except (json.JSONDecodeError, FileNotFoundError):
+        with open(file_path, 'rb') as file:
+            existing_data = orjson.loads(file.read())
+    except (orjson.JSONDecodeError, FileNotFoundError):
         existing_data = []
-
-    # Create a dictionary to hold data with unique identifiers as keys
     data_dict = {(entry["date"], entry["name"]): entry for entry in existing_data}
 
-    # Update the dictionary with new data
-    for entry in data:
+    # Replay rows journaled by a previous interrupted run
+    try:
+        with open(journal_file, 'rb') as file:
+            for line in file:
+                try:
+                    entry = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    break  # truncated tail from a crash mid-write
+                data_dict[(entry["date"], entry["name"])] = entry
+    except FileNotFoundError:
+        pass
+
+    return data_dict
+
+def merge(data_dict, entries):
+    """
+    Merge new data entries into the accumulated data dictionary.
+
+    Args:
+        data_dict (dict): Accumulated entries keyed by (date, name).
+        entries (list): New data entries (dictionaries) to merge in.
+    """
+    for entry in entries:
         identifier = (entry["date"], entry["name"])
         data_dict[identifier] = entry
 
-    # Convert the dictionary back to a list of data entries
-    existing_data = list(data_dict.values())
+def append_journal(journal, entries):
+    """
+    Append data entries to the run journal, one JSON document per line.
+
+    Writes are O(new rows) and survive a crash; the journal is replayed
+    by load_existing and removed once flush has compacted it.
+
+    Args:
+        journal (file): The journal file opened in append-binary mode.
+        entries (list): New data entries (dictionaries) to append.
+    """
+    for entry in entries:
+        journal.write(orjson.dumps(entry) + b'\n')
+    journal.flush()
 
-    with open(file_path, 'w', encoding='utf-8') as file:
-        json.dump(existing_data, file, indent=4, ensure_ascii=False)
+def flush(data_dict, file_path):
+    """
+    Write the accumulated data entries to a JSON file and drop the
+    journal they were compacted from.
+
+    Args:
+        data_dict (dict): Accumulated entries keyed by (date, name).
+        file_path (str): The path to the JSON file where data will be saved.
+    """
+    with open(file_path, 'wb') as file:
+        file.write(orjson.dumps(list(data_dict.values()), option=orjson.OPT_INDENT_2))
+    if os.path.exists(journal_file):
+        os.remove(journal_file)
 
 def remove_attribute(text, attribute_name, quote_character='"'):
     """
@@ -130,126 +232,143 @@ def remove_attribute(text, attribute_name, quote_character='"'):
     Returns:
         str: The text with the specified attribute removed.
     """
-    pattern = r'{}={}[^{}]*{}'.format(attribute_name, quote_character, quote_character, quote_character)
-    return re.sub(pattern, '', text)
+    key = (attribute_name, quote_character)
+    pattern = _ATTR_PATTERNS.get(key)
+    if pattern is None:
+        pattern = _ATTR_PATTERNS[key] = re.compile(r'{}={}[^{}]*{}'.format(attribute_name, quote_character, quote_character, quote_character))
+    return pattern.sub('', text)
 
-def insert_newline_before_datetime(text):
+def _comma_to_dot(match):
     """
-    Insert a newline character before datetime patterns in the text.
-
-    Args:
-        text (str): The input text.
-
-    Returns:
-        str: The text with newlines inserted before datetime patterns.
+    Return the matched number with comma separators replaced by dots.
     """
-    pattern = r'\d{2}/\d{2}/\d{4} \d{2}:\d{2}'
-    updated_text = re.sub(pattern, r'\n\g<0>', text)
-    return updated_text
+    return match.group(0).replace(',', '.')
 
-def extract_datetime_lines_with_text(text):
+def _fix_range(range_str):
     """
-    Extract lines with datetime patterns from the text.
-
-    Args:
-        text (str): The input text.
-
-    Returns:
-        str: Extracted lines with datetime patterns.
+    Return a shared, comma-fixed copy of a range string, running the
+    float regex only once per distinct range.
     """
-    pattern = r'^(\d{2}/\d{2}/\d{4} \d{2}:\d{2}.*)'
-    datetime_lines = re.findall(pattern, text, re.MULTILINE)
-    return "\n".join(datetime_lines)
+    fixed = _RANGE_CACHE.get(range_str)
+    if fixed is None:
+        fixed = _RANGE_CACHE[range_str] = _FLOAT_RE.sub(_comma_to_dot, range_str)
+    return fixed
 
-def fix_floating_point_numbers(text):
+def extract_lines_with_specified_format(text):
     """
-    Replace comma separators with dots in floating-point numbers.
+    Extract lines with a specified format from the text.
+
+    Builds all rows in one bulk findall plus a single list comprehension,
+    avoiding a Match object and generator resumption per row. The date
+    and value fields are already validated by _ROW_RE itself, so no
+    per-row re-checking is needed downstream.
 
     Args:
         text (str): The input text.
 
     Returns:
-        str: The text with fixed floating-point numbers.
+        list: Extracted data entries (dictionaries).
     """
-    def replace_comma_with_dot(match):
-        number = match.group(0)
-        return number.replace(',', '.')
-    pattern = r'\d+(?:,\d+)+|\d+,\d+'
-    return re.sub(pattern, replace_comma_with_dot, text)
+    # Many rows repeat the same name/unit/range; map each repeat to a
+    # single shared string object instead of keeping one copy per row
+    dedup = _STRING_CACHE.setdefault
+    return [
+        {
+            'date': date,
+            'oldvalue': oldvalue.replace(',', '.'),
+            'range': _fix_range(range),
+            'unit': dedup(unit, unit),
+            'value': value.replace(',', '.'),
+            'name': dedup(name, name)
+        }
+        for date, oldvalue, range, unit, value, name in _ROW_RE.findall(text)
+    ]
 
-def extract_lines_with_specified_format(text):
+def file_read(path):
     """
-    Extract lines with a specified format from the text.
+    Read a text file, trying UTF-8 first and detecting the encoding only
+    on failure. pdf2htmlEX emits UTF-8, so the fast path decodes the
+    bytes directly without a detection scan or a second read.
 
     Args:
-        text (str): The input text.
+        path (str): The path to the file to read.
 
     Returns:
-        str: Extracted lines with the specified format.
+        str: The decoded file content.
     """
-    pattern = r'(?m)^(\d{2}/\d{2}/\d{4} \d{2}:\d{2})\|(\d+(?:[.,]\d+)?)\|([^|]+)\|([^|]+)\|(\d+(?:[.,]\d+)?)\|([^|]*)\|(.*)$'
-    datetime_lines = re.findall(pattern, text)
-
-    extracted_data = []
-    for date, oldvalue, range, unit, value, name, rest in datetime_lines:
-        data_dict = {
-            'date': date,
-            'oldvalue': oldvalue,
-            'range': range,
-            'unit': unit,
-            'value': value,
-            'name': name
-        }
-        extracted_data.append(data_dict)
-    save_as_json(extracted_data, data_file)
-
-    return "\n".join(f"{date}|{oldvalue}|{range}|{unit}|{value}|{name}" for date, oldvalue, range, unit, value, name, rest in datetime_lines)
+    with open(path, 'rb') as file:
+        raw_data = file.read()
+    try:
+        return raw_data.decode('utf-8')
+    except UnicodeDecodeError:
+        encoding = charset_normalizer.from_bytes(raw_data).best().encoding
+        return raw_data.decode(encoding)
 
-def process_html_data(read_path, write_path):
+def process_html_data(read_path):
     """
-    Process data from an HTML file and save it as a text file.
+    Extract data entries from an HTML file.
 
     Args:
         read_path (str): The path to the input HTML file.
-        write_path (str): The path to the output text file.
-    """
-    # Detect encoding
-    with open(read_path, 'rb') as file:
-        raw_data = file.read()
-
-    result = chardet.detect(raw_data)
-    encoding = result['encoding']
 
+    Returns:
+        list: Extracted data entries (dictionaries).
+    """
     # Read
-    with open(read_path, 'r', encoding=encoding) as file:
-        content = file.read()
+    content = file_read(read_path)
 
     # Modify
     content = remove_attribute(content, "class")
     content = remove_attribute(content, "id")
+    # data-data only carries page rendering metadata (ctm matrices for
+    # exe/data/pdf2htmlEX.js), never the result rows, so it is stripped
+    # rather than parsed
     content = remove_attribute(content, "data-data", "'")
     content = remove_attribute(content, "data-page-no")
-    while " >" in content:
-        content = content.replace(" >", ">")
-    content = content.replace("</div></div><div><div>", "|")
-    content = content.replace("</div><div>", " ")
-    content = content.replace("<div>", "")
-    content = content.replace("</div>", "")
-    content = content.replace("<span>", "")
-    content = content.replace("</span>", "")
+    content = _HTML_TAG_RE.sub(_html_tag_replacement, content)
     content = html.unescape(content)# Decode HTML entities
     #content = content.replace(">", "").replace("<", "")# Remove any remaining < and > characters
+    # Strip the out-of-range '*' markers before collapsing spaces around
+    # '|' so a space left behind by a removed marker is still cleaned up
     content = content.replace("*", "")
-    content = content.replace("| ", "|")
-    content = content.replace(" |", "|")
-    content = insert_newline_before_datetime(content)
-    content = extract_datetime_lines_with_text(content)
-    content = fix_floating_point_numbers(content)
-    content = extract_lines_with_specified_format(content)
+    content = _BAR_FIX_RE.sub('|', content)
+    return extract_lines_with_specified_format(content)
 
-    # Write
-    with open(write_path, 'w', encoding=encoding) as file:
-        file.write(content)
+def process_one_pdf(pdf_file):
+    """
+    Convert a single PDF file to HTML and extract its data rows.
+
+    Runs in a worker process; uses a per-process output directory so
+    concurrent workers do not collide on the shared temporary folder.
+
+    Args:
+        pdf_file (str): The name of the PDF file inside the pdf directory.
+
+    Returns:
+        list: Extracted data entries (dictionaries).
+    """
+    work_dir = "{}_{}".format(out_dir, os.getpid())
+    work_path = _SCRIPT_DIR / work_dir
+
+    # Convert the PDF file to HTML
+    argv = [
+        str(EXE_PATH / "pdf2htmlEX.exe"),
+        "--embed", "cfijo",
+        "--dest-dir", str(work_path),
+        "--optimize-text", "1",
+        "--process-nontext", "0",
+        str(PDF_PATH / pdf_file)
+    ]
+    run_process(argv)
+
+    read_path = work_path / "{}.html".format(Path(pdf_file).stem)
+
+    extracted_data = process_html_data(read_path)
+
+    # Remove the per-process out directory
+    remove_directory(work_dir)
+
+    return extracted_data
 
 if __name__ == "__main__":
     sys.stdout.reconfigure(encoding='utf-8')
@@ -265,30 +384,23 @@ if __name__ == "__main__":
     # Remove out directory if exists
     remove_directory(out_dir)
 
-    pdf_files = [file for file in os.listdir(pdf_dir) if file.lower().endswith('.pdf')]
+    with os.scandir(PDF_PATH) as entries:
+        pdf_files = [entry.name for entry in entries if entry.is_file() and entry.name.lower().endswith('.pdf')]
     if not pdf_files:
         print(f"No PDF files found in the {pdf_dir} directory")
         exit(1)
 
-    print("PDF files in the directory: {}".format(len(pdf_files)))
+    total = len(pdf_files)
+    print("PDF files in the directory: {}".format(total))
+    data_dict = load_existing(data_file)
     pdf_file_count = 0
-    for pdf_file in pdf_files:
-        pdf_file_count = pdf_file_count + 1
-        print(f"----- processing {pdf_file} {pdf_file_count}/{len(pdf_files)}")
-
-        # Run a command and capture its output
-        command = "{}/pdf2htmlEX.exe --embed cfijo --dest-dir \"{}\" --optimize-text 1 --process-nontext 0 \"{}/{}\"".format(exe_dir, out_dir, pdf_dir, pdf_file)
-        run_process(command)
-
-        fname = os.path.splitext(os.path.basename(pdf_file))[0]
-        read_path = "{}/{}.html".format(out_dir, fname)
-        write_path = "{}/{}.txt".format(out_dir, fname)
-
-        process_html_data(read_path, write_path)
-
-        # Remove out directory
-        remove_directory(out_dir)
-
-        print(f"----- {pdf_file} done {pdf_file_count}/{len(pdf_files)}", flush=True)
-    
-    print(f"All done {pdf_file_count}/{len(pdf_files)}")
\ No newline at end of file
+    with open(journal_file, 'ab') as journal:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for pdf_file, extracted_data in zip(pdf_files, executor.map(process_one_pdf, pdf_files)):
+                pdf_file_count = pdf_file_count + 1
+                merge(data_dict, extracted_data)
+                append_journal(journal, extracted_data)
+                print(f"----- {pdf_file} done {pdf_file_count}/{total}")
+
+    flush(data_dict, data_file)
+    print(f"All done {pdf_file_count}/{total}")
\ No newline at end of file